@@ -56,10 +56,26 @@ def create_app():
         session.permanent = True
         session.modified = True
 
-    # --- 5. ROTA RAIZ (MANTIDO) ---
+    # --- 5. VERIFICAÇÃO LOCAL DO TOKEN (JWT) ---
+    # Valida o access token do Supabase sem chamada de rede e popula g.user
+    from app.core.tokens import iniciar_verificacao, carregar_usuario, fechar_user_db
+    iniciar_verificacao()
+    app.before_request(carregar_usuario)
+    app.teardown_appcontext(fechar_user_db)
+
+    # Re-deriva os contextos do Sidebar quando o admin ativa/suspende módulos
+    from app.core.auth import sincronizar_contextos
+    app.before_request(sincronizar_contextos)
+
+    # --- 6. ROTA RAIZ (MANTIDO) ---
     @app.route('/')
     def index():
         # Redireciona para o login correto
         return redirect(url_for('auth.login'))
 
+    # --- 7. TEMPLATES: CACHE DE FRAGMENTOS + PRÉ-COMPILAÇÃO ---
+    # Deve rodar após o registro dos blueprints (templates dos módulos)
+    from app.core.fragment_cache import configurar_templates
+    configurar_templates(app)
+
     return app
\ No newline at end of file
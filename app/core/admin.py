@@ -1,6 +1,8 @@
-from flask import Blueprint, render_template, session, redirect, url_for, request, flash
+from flask import Blueprint, render_template, session, redirect, url_for, request, flash, jsonify, g
 from supabase import create_client, Client
 from app.utils import normalizar_texto
+from app.core.gateway import executar_consulta, estatisticas
+from app.core.fragment_cache import fragment_cache
 from app import supabase
 import os
 
@@ -24,24 +26,36 @@ def log_action(action, details, target_user_id=None):
     except Exception as e:
         print(f"ERRO DE AUDITORIA: {e}")
 
+def listar_modulos():
+    """Catálogo de módulos (leitura compartilhada entre requisições simultâneas)."""
+    return executar_consulta(
+        ('modules',),
+        lambda: supabase.table("modules").select("*").execute(),
+        servico='anon'
+    )
+
 # --- MIDDLEWARE DE SEGURANÇA ---
 @admin_bp.before_request
 def restrict_to_superadmin():
     if 'user_id' not in session:
         return redirect(url_for('auth.login'))
     
-    # Verifica cache de sessão ou consulta banco para garantir privilégios
-    if session.get('is_super_admin'):
+    # Autorização local: claims do token já verificados no middleware (sem chamada de rede).
+    # A flag de super admin vem do claim app_metadata ou do login (validada em 'profiles').
+    usuario = g.get('user')
+    if usuario and usuario['is_super_admin']:
         return None
 
-    res = supabase.table("profiles").select("is_super_admin").eq("id", session['user_id']).single().execute()
-    if res.data and res.data.get('is_super_admin'):
-        session['is_super_admin'] = True # Otimização de performance
-        return None
-    
     flash("Acesso restrito ao Super Administrador.")
     return redirect(url_for('academia.dashboard'))
 
+# --- ESTATÍSTICAS DA PLATAFORMA ---
+
+@admin_bp.route('/stats')
+def stats():
+    """Estado dos circuit breakers, leituras agrupadas e acertos do cache de fragmentos."""
+    return jsonify({"supabase": estatisticas(), "templates": fragment_cache.estatisticas()})
+
 # --- ROTAS DE CLIENTES ---
 
 @admin_bp.route('/clientes')
@@ -141,7 +155,7 @@ def criar_cliente():
             return redirect(url_for('admin.criar_cliente'))
 
     # GET: Carrega módulos disponíveis para o formulário
-    modules_res = supabase.table("modules").select("*").execute()
+    modules_res = listar_modulos()
     return render_template('admin/form_cliente.html', modules=modules_res.data)
 
 @admin_bp.route('/clientes/status/<tenant_id>/<novo_status>', methods=['POST'])
@@ -160,7 +174,7 @@ def alterar_status(tenant_id, novo_status):
 def gerenciar_modulos_cliente(tenant_id):
     try:
         modulos_cliente = admin_supabase.table("tenant_modules").select("module_id, is_enabled, modules(name)").eq("tenant_id", tenant_id).execute()
-        todos_modulos = supabase.table("modules").select("*").execute()
+        todos_modulos = listar_modulos()
         tenant = admin_supabase.table("tenants").select("name").eq("id", tenant_id).single().execute()
         
         return render_template('admin/modulos_cliente.html', 
@@ -1,5 +1,9 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify
 from supabase import create_client, Client
+from app.core.gateway import executar_consulta
+import hashlib
+import json
+import time
 import os
 import gotrue.errors
 
@@ -12,6 +16,94 @@ try:
 except:
     supabase = None
 
+# Cliente Admin (Service Role) - Leitura de tenant_modules na sincronização de contextos
+try:
+    admin_supabase: Client = create_client(supabase_url, os.environ.get("SUPABASE_SERVICE_KEY"))
+except:
+    admin_supabase = None
+
+# Intervalo mínimo entre verificações da versão dos módulos (por sessão)
+INTERVALO_SYNC_MODULOS = int(os.getenv("MODULES_SYNC_INTERVAL", "30"))
+
+
+def _montar_contextos(tenants, modulos):
+    """
+    Monta a lista de contextos do Sidebar.
+
+    Args:
+        tenants: {tenant_id: {'name': ..., 'role': ...}} das unidades do usuário
+        modulos: linhas de tenant_modules (tenant_id, module_id, is_enabled, modules.name)
+    """
+    user_contexts = []
+    for mod_rel in modulos:
+        tenant = tenants.get(mod_rel['tenant_id'])
+        # Módulos suspensos pelo admin não entram no Sidebar
+        if not tenant or mod_rel.get('is_enabled') is False:
+            continue
+        user_contexts.append({
+            'tenant_id': mod_rel['tenant_id'],
+            'tenant_name': tenant['name'],
+            'module_id': mod_rel['module_id'],
+            'module_name': mod_rel['modules']['name'],
+            'role': tenant['role']
+        })
+    return user_contexts
+
+
+def _versao_modulos(modulos):
+    """Versão dos módulos das unidades: muda quando um módulo é adicionado, ativado ou suspenso."""
+    estado = sorted((m['tenant_id'], m['module_id'], m.get('is_enabled') is not False) for m in modulos)
+    return hashlib.sha1(json.dumps(estado).encode()).hexdigest()[:16]
+
+
+def sincronizar_contextos():
+    """
+    Middleware: re-deriva session['user_contexts'] quando o admin ativa/suspende módulos.
+
+    A versão vem do próprio banco (tenant_modules), lida pelo gateway com singleflight:
+    vale para todos os workers e usuários da mesma unidade compartilham a consulta.
+    Quando muda, ctx_version é incrementado e o Sidebar em cache é renderizado de novo.
+    """
+    tenants = session.get('tenants')
+    if not tenants or not admin_supabase or session.get('role') == 'super_admin':
+        return
+    if time.time() - session.get('modules_checked_at', 0) < INTERVALO_SYNC_MODULOS:
+        return
+    session['modules_checked_at'] = time.time()
+
+    tenant_ids = tuple(sorted(tenants))
+    try:
+        resp = executar_consulta(
+            ('tenant_modules', tenant_ids),
+            lambda: admin_supabase.table('tenant_modules')
+                .select('tenant_id, module_id, is_enabled, modules(name)')
+                .in_('tenant_id', list(tenant_ids))
+                .order('module_id')
+                .execute(),
+            servico='admin'
+        )
+    except Exception as e:
+        # Mantém os contextos atuais; nova tentativa no próximo intervalo
+        print(f"Erro ao sincronizar módulos: {e}")
+        return
+
+    modulos = resp.data or []
+    versao = _versao_modulos(modulos)
+    if versao == session.get('modules_version'):
+        return
+
+    user_contexts = _montar_contextos(tenants, modulos)
+    session['user_contexts'] = user_contexts
+    session['modules_version'] = versao
+    session['ctx_version'] = time.time()
+
+    # Contexto selecionado foi suspenso: volta ao Estado Neutro
+    atual = (session.get('tenant_id'), session.get('module_id'))
+    if atual[0] and not any((c['tenant_id'], c['module_id']) == atual for c in user_contexts):
+        session['tenant_id'] = None
+        session['tenant_name'] = None
+        session['module_id'] = None
+
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -28,6 +120,9 @@ def login():
             session['user_id'] = user.id
             session['user_email'] = user.email
             session['access_token'] = auth_response.session.access_token
+            session['refresh_token'] = auth_response.session.refresh_token
+            # Versão do contexto na chave do cache de fragmentos (sidebar): vale para todos os workers
+            session['ctx_version'] = time.time()
 
             # 2. Check Superadmin (Prioridade 1)
             profile_resp = supabase.table('profiles').select('is_super_admin').eq('id', user.id).maybe_single().execute()
@@ -40,7 +135,7 @@ def login():
             # 3. Mapeamento de Contextos para Clientes
             # Busca todas as unidades e módulos ativos de uma só vez
             rpc_query = supabase.table('tenant_members')\
-                .select('tenant_id, role, tenants(name, tenant_modules(module_id, modules(name))))')\
+                .select('tenant_id, role, tenants(name, tenant_modules(module_id, is_enabled, modules(name))))')\
                 .eq('user_id', user.id)\
                 .execute()
 
@@ -50,20 +145,20 @@ def login():
                 return redirect(url_for('auth.login'))
 
             # Organiza o mapa de contextos para o Sidebar
-            user_contexts = []
+            tenants = {}
+            modulos = []
             for item in raw_data:
                 tenant_id = item['tenant_id']
-                tenant_name = item['tenants']['name']
-                role = item['role']
-                
+                tenants[tenant_id] = {'name': item['tenants']['name'], 'role': item['role']}
                 for mod_rel in item['tenants']['tenant_modules']:
-                    user_contexts.append({
-                        'tenant_id': tenant_id,
-                        'tenant_name': tenant_name,
-                        'module_id': mod_rel['module_id'],
-                        'module_name': mod_rel['modules']['name'],
-                        'role': role
-                    })
+                    modulos.append({'tenant_id': tenant_id, **mod_rel})
+
+            user_contexts = _montar_contextos(tenants, modulos)
+
+            # Unidades e versão dos módulos: base para sincronizar_contextos()
+            session['tenants'] = tenants
+            session['modules_version'] = _versao_modulos(modulos)
+            session['modules_checked_at'] = time.time()
 
             if not user_contexts:
                 flash('Nenhum módulo ativo encontrado para suas unidades.', 'info')
@@ -107,6 +202,7 @@ def set_context():
         session['tenant_id'] = valid_ctx['tenant_id']
         session['tenant_name'] = valid_ctx['tenant_name']
         session['module_id'] = valid_ctx['module_id']
+        session['ctx_version'] = time.time()
         return jsonify({"success": True, "redirect": url_for(f"{m_id}.dashboard")})
     
     return jsonify({"success": False, "error": "Contexto inválido"}), 403
@@ -0,0 +1,112 @@
+from jinja2 import nodes, FileSystemBytecodeCache
+from jinja2.ext import Extension
+from collections import OrderedDict
+import threading
+import time
+import os
+
+# ===================================================================
+# CACHE DE FRAGMENTOS DE TEMPLATE (JINJA)
+# ===================================================================
+# Uso no template:
+#   {% cache 'sidebar', user_id, tenant_id, outras_partes... %} ... {% endcache %}
+#
+# A chave combina o nome do fragmento, o usuário, o tenant e as partes extras.
+# Não há invalidação explícita: o cache é por processo (cada worker do Gunicorn
+# tem o seu), então mudanças entram na chave por um valor guardado na sessão
+# (ex: session['ctx_version'], incrementado no login, set_context e quando os
+# módulos das unidades mudam). As entradas antigas expiram pelo TTL/limite.
+
+TTL_PADRAO = int(os.getenv("FRAGMENT_CACHE_TTL", "300"))
+MAX_ENTRADAS = int(os.getenv("FRAGMENT_CACHE_MAX", "2048"))
+# Sem JINJA_BYTECODE_DIR, o Jinja cria uma pasta própria do usuário (0700, dono verificado).
+# NUNCA aponte para um caminho previsível em /tmp: os arquivos .cache são carregados com marshal.
+PASTA_BYTECODE = os.getenv("JINJA_BYTECODE_DIR")
+
+
+class FragmentCache:
+    """Armazena fragmentos renderizados com TTL e limite de entradas (LRU)."""
+
+    def __init__(self, ttl=TTL_PADRAO, max_entradas=MAX_ENTRADAS):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def obter_ou_renderizar(self, partes, renderizar):
+        nome, user_id, tenant_id, *extras = list(partes) + [None] * (3 - len(partes))
+        agora = time.monotonic()
+
+        with self._lock:
+            chave = (nome, user_id, tenant_id, *extras)
+            item = self._entradas.get(chave)
+            if item and item[0] > agora:
+                self._hits += 1
+                self._entradas.move_to_end(chave)
+                return item[1]
+            self._misses += 1
+
+        # Renderiza fora do lock (outras threads continuam lendo o cache)
+        valor = renderizar()
+
+        with self._lock:
+            self._entradas[chave] = (agora + self.ttl, valor)
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+        return valor
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                "entradas": len(self._entradas),
+                "hits": self._hits,
+                "misses": self._misses
+            }
+
+
+# Instância única (estatísticas expostas em /admin/stats)
+fragment_cache = FragmentCache()
+
+
+class FragmentCacheExtension(Extension):
+    """Adiciona a tag {% cache nome, user_id, tenant_id, ... %}...{% endcache %} ao Jinja."""
+
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+
+        partes = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            partes.append(parser.parse_expression())
+
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method("_renderizar_com_cache", [nodes.List(partes)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _renderizar_com_cache(self, partes, caller):
+        return fragment_cache.obter_ou_renderizar(partes, caller)
+
+
+def configurar_templates(app):
+    """
+    Registra a extensão de cache e o cache de bytecode, depois pré-compila
+    todos os templates (o primeiro acesso de cada página não paga a compilação).
+    Deve ser chamada antes de qualquer acesso a app.jinja_env.
+    """
+    app.jinja_options = {
+        **app.jinja_options,
+        "extensions": [*app.jinja_options.get("extensions", []), FragmentCacheExtension],
+        "bytecode_cache": FileSystemBytecodeCache(PASTA_BYTECODE) if PASTA_BYTECODE else FileSystemBytecodeCache()
+    }
+
+    total = 0
+    for nome in app.jinja_env.list_templates():
+        if nome.endswith(".html"):
+            app.jinja_env.get_template(nome)
+            total += 1
+    print(f"Templates pré-compilados: {total}")
@@ -0,0 +1,256 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from collections import OrderedDict
+from postgrest.exceptions import APIError
+import threading
+import httpx
+import time
+import os
+
+# ===================================================================
+# CAMADA COMPARTILHADA DE CHAMADAS AO SUPABASE
+# ===================================================================
+# Quando o banco fica lento, requisições simultâneas do mesmo tenant
+# disparam consultas idênticas e esgotam os workers. Esta camada:
+#   1. Agrupa leituras idênticas em andamento (singleflight)
+#   2. Aplica um prazo máximo (deadline) por chamada
+#   3. Abre um circuit breaker após falhas consecutivas de infraestrutura
+#      (rede, timeout, 5xx). Erros de aplicação (4xx, PGRST116, RLS) não contam.
+#   4. Serve a última resposta válida (modo degradado) com o circuito aberto
+#
+# IMPORTANTE: Use apenas para LEITURAS. Escritas não devem ser agrupadas.
+
+TIMEOUT_PADRAO = float(os.getenv("SUPABASE_CALL_TIMEOUT", "5"))
+LIMITE_FALHAS = int(os.getenv("SUPABASE_BREAKER_FAILURES", "5"))
+TEMPO_RECUPERACAO = float(os.getenv("SUPABASE_BREAKER_RESET", "30"))
+VALIDADE_CACHE = float(os.getenv("SUPABASE_STALE_TTL", "300"))
+MAX_ENTRADAS_CACHE = 1024
+CODIGOS_PGRST_INDISPONIVEL = {'PGRST000', 'PGRST001', 'PGRST002', 'PGRST003'}
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SUPABASE_MAX_WORKERS", "16")),
+    thread_name_prefix="supabase-gateway"
+)
+
+
+class CircuitoAbertoError(Exception):
+    """Circuito aberto e sem resposta em cache para servir."""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker simples (closed -> open -> half_open -> closed).
+
+    - closed: chamadas passam normalmente
+    - open: chamadas são recusadas até passar o tempo de recuperação
+    - half_open: uma única chamada de teste é liberada; sucesso fecha o circuito
+    """
+
+    def __init__(self, nome, limite_falhas=LIMITE_FALHAS, tempo_recuperacao=TEMPO_RECUPERACAO):
+        self.nome = nome
+        self.limite_falhas = limite_falhas
+        self.tempo_recuperacao = tempo_recuperacao
+        self.estado = 'closed'
+        self.falhas_consecutivas = 0
+        self.aberto_em = None
+        self.vezes_aberto = 0
+        self._teste_em_andamento = False
+        self._lock = threading.Lock()
+
+    def permite_chamada(self):
+        with self._lock:
+            if self.estado == 'closed':
+                return True
+            if self.estado == 'open':
+                if time.monotonic() - self.aberto_em < self.tempo_recuperacao:
+                    return False
+                self.estado = 'half_open'
+            # half_open: libera apenas uma chamada de teste por vez
+            if self._teste_em_andamento:
+                return False
+            self._teste_em_andamento = True
+            return True
+
+    def registrar_sucesso(self):
+        with self._lock:
+            self.estado = 'closed'
+            self.falhas_consecutivas = 0
+            self.aberto_em = None
+            self._teste_em_andamento = False
+
+    def registrar_falha(self):
+        with self._lock:
+            self.falhas_consecutivas += 1
+            self._teste_em_andamento = False
+            if self.estado == 'half_open' or self.falhas_consecutivas >= self.limite_falhas:
+                if self.estado != 'open':
+                    self.vezes_aberto += 1
+                self.estado = 'open'
+                self.aberto_em = time.monotonic()
+
+    def resumo(self):
+        with self._lock:
+            return {
+                "estado": self.estado,
+                "falhas_consecutivas": self.falhas_consecutivas,
+                "vezes_aberto": self.vezes_aberto
+            }
+
+
+# --- ESTADO GLOBAL DA CAMADA ---
+_lock = threading.RLock()  # RLock: o done_callback pode rodar na própria thread
+_em_andamento = {}              # chave -> Future compartilhado (singleflight)
+_ultimas_respostas = OrderedDict()  # chave -> (timestamp, resposta) para modo degradado
+_breakers = {}
+_contadores = {
+    "chamadas": 0,
+    "agrupadas": 0,
+    "falhas": 0,
+    "timeouts": 0,
+    "degradadas": 0,
+    "recusadas": 0
+}
+
+
+def _incrementar(contador):
+    with _lock:
+        _contadores[contador] += 1
+
+
+def get_breaker(servico):
+    with _lock:
+        if servico not in _breakers:
+            _breakers[servico] = CircuitBreaker(servico)
+        return _breakers[servico]
+
+
+def _guardar_resposta(chave, resposta):
+    with _lock:
+        _ultimas_respostas[chave] = (time.monotonic(), resposta)
+        _ultimas_respostas.move_to_end(chave)
+        while len(_ultimas_respostas) > MAX_ENTRADAS_CACHE:
+            _ultimas_respostas.popitem(last=False)
+
+
+def _resposta_degradada(chave):
+    """Retorna a última resposta válida da chave, se ainda estiver dentro da validade."""
+    with _lock:
+        item = _ultimas_respostas.get(chave)
+    if item and time.monotonic() - item[0] <= VALIDADE_CACHE:
+        _incrementar("degradadas")
+        return True, item[1]
+    return False, None
+
+
+def _falha_de_infraestrutura(erro):
+    """
+    True apenas para erros que indicam backend indisponível: transporte, timeout,
+    5xx ou PGRST000-003. Demais APIError (PGRST116, SQLSTATE como 42501/23505,
+    token expirado) significam que o banco respondeu.
+    """
+    if isinstance(erro, (httpx.TransportError, TimeoutError)):
+        return True
+    if isinstance(erro, httpx.HTTPStatusError):
+        return erro.response.status_code >= 500
+    if isinstance(erro, APIError):
+        # PGRST000-PGRST003: PostgREST sem acesso ao pool do banco (HTTP 503)
+        if erro.code in CODIGOS_PGRST_INDISPONIVEL:
+            return True
+        # Resposta não-JSON (generate_default_error_message): 'code' é o status HTTP (int).
+        # Nos demais casos 'code' é o SQLSTATE do Postgres (ex: '42501' = RLS) -> não conta.
+        if isinstance(erro.code, int) and erro.message == "JSON could not be generated":
+            return erro.code >= 500
+    return False
+
+
+def _liberar_chave(chave, future):
+    with _lock:
+        if _em_andamento.get(chave) is future:
+            del _em_andamento[chave]
+
+
+def executar_consulta(chave, consulta, servico, timeout=None):
+    """
+    Executa uma leitura no Supabase através da camada compartilhada.
+
+    Args:
+        chave: Identificador da leitura (ex: ('licenca', tenant_id)). Chamadas
+            simultâneas com a mesma chave compartilham uma única execução.
+        consulta: Função sem argumentos que executa a query (ex: lambda: ...execute()).
+        servico: Nome do circuit breaker, um por cliente: 'admin' (Service Role),
+            'anon' (Anon Key) ou 'user' (token do usuário).
+        timeout: Prazo máximo em segundos (padrão: SUPABASE_CALL_TIMEOUT).
+
+    Returns:
+        A resposta da consulta, ou a última resposta válida em modo degradado.
+
+    Raises:
+        CircuitoAbertoError: Circuito aberto e nenhuma resposta em cache.
+        Exception: Falha/timeout da consulta quando não há resposta em cache.
+    """
+    timeout = TIMEOUT_PADRAO if timeout is None else timeout
+    chave = (servico, chave)
+    breaker = get_breaker(servico)
+    _incrementar("chamadas")
+
+    with _lock:
+        future = _em_andamento.get(chave)
+        lider = future is None
+        if not lider:
+            _contadores["agrupadas"] += 1
+        elif breaker.permite_chamada():
+            future = _executor.submit(consulta)
+            _em_andamento[chave] = future
+            future.add_done_callback(lambda f: _liberar_chave(chave, f))
+
+    if future is None:
+        # Circuito aberto: não toca no banco, serve o cache (se houver)
+        _incrementar("recusadas")
+        encontrado, resposta = _resposta_degradada(chave)
+        if encontrado:
+            return resposta
+        raise CircuitoAbertoError(f"Circuito '{servico}' aberto: Supabase indisponível.")
+
+    try:
+        resposta = future.result(timeout=timeout)
+    except FutureTimeoutError as e:
+        if lider:
+            _incrementar("timeouts")
+            _incrementar("falhas")
+            breaker.registrar_falha()
+        encontrado, resposta = _resposta_degradada(chave)
+        if encontrado:
+            return resposta
+        raise TimeoutError(f"Consulta ao Supabase excedeu {timeout}s: {chave[1]}") from e
+    except Exception as e:
+        if not _falha_de_infraestrutura(e):
+            # O backend respondeu: não abre o circuito nem mascara o erro com cache
+            if lider:
+                breaker.registrar_sucesso()
+            raise
+        if lider:
+            _incrementar("falhas")
+            breaker.registrar_falha()
+        encontrado, resposta = _resposta_degradada(chave)
+        if encontrado:
+            return resposta
+        raise
+
+    if lider:
+        breaker.registrar_sucesso()
+        _guardar_resposta(chave, resposta)
+    return resposta
+
+
+def estatisticas():
+    """Resumo da camada: estado dos breakers e contadores (inclui leituras agrupadas)."""
+    with _lock:
+        contadores = dict(_contadores)
+        em_andamento = len(_em_andamento)
+        em_cache = len(_ultimas_respostas)
+        breakers = list(_breakers.values())
+    return {
+        "breakers": {b.nome: b.resumo() for b in breakers},
+        "contadores": contadores,
+        "em_andamento": em_andamento,
+        "respostas_em_cache": em_cache
+    }
@@ -0,0 +1,272 @@
+from flask import session, g
+from concurrent.futures import ThreadPoolExecutor
+from postgrest import SyncPostgrestClient
+import threading
+import requests
+import time
+import jwt
+import os
+
+# ===================================================================
+# VERIFICAÇÃO LOCAL DO ACCESS TOKEN (JWT) DO SUPABASE
+# ===================================================================
+# O token salvo no login é validado a cada requisição SEM chamada de rede:
+# - Chaves assimétricas (RS256/ES256): buscadas no JWKS do projeto e cacheadas
+# - Chave simétrica (HS256): validada com SUPABASE_JWT_SECRET
+# Os claims (user id, role, expiração) ficam em g.user para as rotas.
+# Tokens perto de expirar são renovados na própria requisição (o cookie volta atualizado).
+#
+# A configuração é checada uma vez no startup (iniciar_verificacao). Sem segredo
+# nem JWKS disponível, a verificação fica DESATIVADA e g.user vem da sessão
+# (comportamento anterior), em vez de derrubar a sessão de todos os usuários.
+
+supabase_url = os.environ.get("SUPABASE_URL")
+supabase_key = os.environ.get("SUPABASE_KEY")
+jwt_secret = os.environ.get("SUPABASE_JWT_SECRET")
+
+JWKS_TTL = int(os.getenv("SUPABASE_JWKS_TTL", "600"))
+JANELA_RENOVACAO = int(os.getenv("SUPABASE_REFRESH_WINDOW", "120"))
+TIMEOUT_RENOVACAO = float(os.getenv("SUPABASE_REFRESH_TIMEOUT", "5"))
+# Tempo em que o resultado de uma renovação continua disponível para requisições
+# simultâneas que ainda carregam o refresh token antigo (mesmo processo)
+REAPROVEITAMENTO_RENOVACAO = 10
+ALGORITMOS_ASSIMETRICOS = ['RS256', 'ES256']
+
+_jwks_client = None
+_algoritmos_ativos = set()   # Preenchido por iniciar_verificacao()
+
+# Renovações por refresh token antigo: refresh_token -> (criado_em, Future)
+_renovacoes = {}
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="token-refresh")
+
+
+class VerificacaoIndisponivelError(Exception):
+    """Não foi possível verificar o token (JWKS inacessível ou algoritmo sem chave configurada)."""
+
+
+def iniciar_verificacao():
+    """
+    Checa no startup quais algoritmos podem ser verificados localmente.
+    Chamada uma vez pelo create_app().
+    """
+    global _jwks_client
+
+    if not supabase_url:
+        return
+
+    if jwt_secret:
+        _algoritmos_ativos.add('HS256')
+
+    # Cliente JWKS com cache de chaves (só acessa a rede quando o cache expira ou surge um 'kid' novo)
+    _jwks_client = jwt.PyJWKClient(
+        f"{supabase_url}/auth/v1/.well-known/jwks.json",
+        cache_keys=True,
+        lifespan=JWKS_TTL,
+        headers={"apikey": supabase_key or ""}
+    )
+    try:
+        if _jwks_client.get_signing_keys():
+            _algoritmos_ativos.update(ALGORITMOS_ASSIMETRICOS)
+    except jwt.PyJWKClientConnectionError as e:
+        # Auth fora do ar no startup: mantém o JWKS ativo e tenta de novo nas requisições
+        print(f"AVISO: JWKS do Supabase inacessível no startup: {e}")
+        _algoritmos_ativos.update(ALGORITMOS_ASSIMETRICOS)
+    except jwt.PyJWKClientError as e:
+        # Projeto sem chaves assimétricas (somente HS256)
+        print(f"AVISO: JWKS do Supabase sem chaves de assinatura: {e}")
+
+    if _algoritmos_ativos:
+        print(f"Verificação local de tokens ativa: {sorted(_algoritmos_ativos)}")
+    else:
+        print("ERRO DE CONFIGURAÇÃO: Verificação local de tokens DESATIVADA. "
+              "Defina SUPABASE_JWT_SECRET (projetos HS256) ou habilite as chaves assimétricas (JWKS).")
+
+
+def verificar_token(token):
+    """
+    Valida assinatura, expiração e audiência do access token localmente.
+
+    Returns:
+        dict: claims decodificados, ou None se o token for inválido.
+
+    Raises:
+        VerificacaoIndisponivelError: Falha de infraestrutura/configuração (o token
+            não pôde ser avaliado; NÃO significa que seja inválido).
+    """
+    if not token:
+        return None
+
+    try:
+        alg = jwt.get_unverified_header(token).get('alg')
+    except jwt.PyJWTError as e:
+        print(f"Token inválido: {e}")
+        return None
+
+    if alg not in _algoritmos_ativos:
+        raise VerificacaoIndisponivelError(f"Sem chave configurada para tokens {alg}")
+
+    try:
+        if alg == 'HS256':
+            chave = jwt_secret
+        else:
+            chave = _jwks_client.get_signing_key_from_jwt(token).key
+    except jwt.PyJWKClientConnectionError as e:
+        raise VerificacaoIndisponivelError(f"JWKS inacessível: {e}") from e
+    except jwt.PyJWTError as e:
+        print(f"Token inválido: {e}")
+        return None
+
+    try:
+        return jwt.decode(
+            token,
+            chave,
+            algorithms=[alg],
+            audience='authenticated',
+            options={"require": ["exp", "sub"]}
+        )
+    except jwt.PyJWTError as e:
+        print(f"Token inválido: {e}")
+        return None
+
+
+def _renovar_sessao(refresh_token):
+    """Troca o refresh token por uma nova sessão no Supabase Auth."""
+    resp = requests.post(
+        f"{supabase_url}/auth/v1/token",
+        params={"grant_type": "refresh_token"},
+        headers={"apikey": supabase_key},
+        json={"refresh_token": refresh_token},
+        timeout=TIMEOUT_RENOVACAO
+    )
+    resp.raise_for_status()
+    return resp.json()
+
+
+def _renovar(refresh_token):
+    """
+    Renova a sessão DENTRO da requisição atual e grava os novos tokens na sessão,
+    para que voltem ao navegador no cookie desta mesma resposta. Nunca rotacionamos
+    um refresh token sem conseguir devolver o resultado ao cookie: o Supabase revoga
+    a sessão se um token já rotacionado for reutilizado fora do intervalo de reuso.
+
+    Requisições simultâneas do mesmo processo com o mesmo cookie esperam a mesma
+    renovação (e reaproveitam o resultado por alguns segundos) em vez de rotacionar
+    o token de novo. Entre workers, requisições simultâneas caem no intervalo de
+    reuso do Supabase (padrão: 10s). Retorna True se a sessão foi renovada.
+    """
+    agora = time.monotonic()
+    with _lock:
+        for chave, (criado_em, future) in list(_renovacoes.items()):
+            if future.done() and agora - criado_em > REAPROVEITAMENTO_RENOVACAO:
+                del _renovacoes[chave]
+
+        if refresh_token not in _renovacoes:
+            _renovacoes[refresh_token] = (agora, _executor.submit(_renovar_sessao, refresh_token))
+        future = _renovacoes[refresh_token][1]
+
+    try:
+        dados = future.result(timeout=TIMEOUT_RENOVACAO)
+    except Exception as e:
+        print(f"Erro ao renovar sessão: {e}")
+        if future.done():
+            # Falha: libera a chave para uma nova tentativa
+            with _lock:
+                if _renovacoes.get(refresh_token, (None, None))[1] is future:
+                    del _renovacoes[refresh_token]
+        return False
+
+    session['access_token'] = dados['access_token']
+    session['refresh_token'] = dados['refresh_token']
+    return True
+
+
+def _usuario_da_sessao():
+    """g.user a partir da sessão (sem verificação do token - comportamento anterior)."""
+    return {
+        'user_id': session['user_id'],
+        'email': session.get('user_email'),
+        'role': session.get('role'),
+        'jwt_role': None,
+        'exp': None,
+        'is_super_admin': bool(session.get('is_super_admin'))
+    }
+
+
+def carregar_usuario():
+    """
+    Middleware: verifica o access token da sessão e popula g.user.
+
+    - Token válido: g.user com claims decodificados (sem chamada de rede)
+    - Token expirado ou perto de expirar: renovado na própria requisição
+    - Verificação indisponível (JWKS fora do ar): g.user = None, sessão mantida
+    - Assinatura/claims inválidos ou expirado sem renovação: sessão encerrada (Fail-Safe)
+    """
+    g.user = None
+    if 'user_id' not in session or not supabase_url:
+        return
+
+    if not _algoritmos_ativos:
+        g.user = _usuario_da_sessao()
+        return
+
+    try:
+        claims = verificar_token(session.get('access_token'))
+
+        # Expirado (ou perto disso): renova aqui para os novos tokens irem no cookie da resposta.
+        # Se a renovação falhar com o token ainda válido, seguimos com ele.
+        precisa_renovar = claims is None or claims['exp'] - time.time() < JANELA_RENOVACAO
+        if precisa_renovar and session.get('refresh_token'):
+            if _renovar(session['refresh_token']):
+                claims = verificar_token(session.get('access_token'))
+    except VerificacaoIndisponivelError as e:
+        print(f"AVISO: Token não verificado nesta requisição: {e}")
+        return
+
+    if claims is None or claims.get('sub') != session.get('user_id'):
+        session.clear()
+        return
+
+    app_metadata = claims.get('app_metadata') or {}
+    g.user = {
+        'user_id': claims['sub'],
+        'email': claims.get('email'),
+        # 'role' é sempre o papel da aplicação (super_admin/cliente), nos dois caminhos;
+        # o claim 'role' do JWT (ex: 'authenticated') fica em 'jwt_role'
+        'role': session.get('role'),
+        'jwt_role': claims.get('role'),
+        'exp': claims['exp'],
+        # Claim customizado (se configurado no Supabase) ou flag validada no login via 'profiles'
+        'is_super_admin': bool(app_metadata.get('is_super_admin') or session.get('is_super_admin'))
+    }
+
+
+def get_user_db():
+    """
+    Cliente PostgREST autenticado com o token do próprio usuário (RLS aplicado por auth.uid()).
+    Criado uma vez por requisição e fechado no teardown. Não use dentro de
+    executar_consulta: a thread do gateway pode sobreviver à requisição.
+    """
+    if 'user_db' not in g:
+        g.user_db = criar_user_db(session.get('access_token'))
+    return g.user_db
+
+
+def criar_user_db(access_token):
+    """
+    Cliente PostgREST avulso para o token informado. Use dentro de executar_consulta
+    (capture o token por valor antes do lambda) e feche com .session.close().
+    """
+    return SyncPostgrestClient(
+        f"{supabase_url}/rest/v1",
+        headers={
+            "apikey": supabase_key,
+            "Authorization": f"Bearer {access_token}"
+        }
+    )
+
+
+def fechar_user_db(exc=None):
+    user_db = g.pop('user_db', None)
+    if user_db is not None:
+        user_db.session.close()
@@ -1,13 +1,14 @@
 from flask import Blueprint, render_template, session, redirect, url_for, flash, request
 from supabase import create_client, Client
+from app.core.gateway import executar_consulta
+from app.core.tokens import get_user_db
 import os
 
 # ===================================================================
 # CONFIGURAÇÃO DE CLIENTES SUPABASE
 # ===================================================================
 
-# Cliente Normal (Anon Key) - Respeita RLS para operações de usuário
-from app import supabase
+# Cliente do Usuário (get_user_db) - Token do próprio usuário, RLS por auth.uid()
 
 # Cliente Admin (Service Role) - Bypass de RLS para verificações de sistema
 admin_supabase: Client = create_client(
@@ -33,16 +34,22 @@ def verificar_licenca_tenant(tenant_id):
         str: 'active', 'suspended', 'archived' ou 'suspended' em caso de erro
     
     Princípio Fail-Safe: Se houver qualquer erro, assume 'suspended' para bloquear acesso.
+    Com o circuit breaker aberto, serve o último status conhecido (se houver).
     """
     if not tenant_id:
         return 'suspended'
     
     try:
-        response = admin_supabase.table('tenants')\
-            .select('status')\
-            .eq('id', tenant_id)\
-            .single()\
-            .execute()
+        # Leituras simultâneas do mesmo tenant são agrupadas em uma só consulta
+        response = executar_consulta(
+            ('licenca', tenant_id),
+            lambda: admin_supabase.table('tenants')
+                .select('status')
+                .eq('id', tenant_id)
+                .single()
+                .execute(),
+            servico='admin'
+        )
         
         if response.data:
             status = response.data.get('status', 'suspended')
@@ -87,7 +94,7 @@ def gerenciar_alunos():
     SEGURANÇA:
     - Verifica status da licença usando Service Role (bypass RLS)
     - Bloqueia interface se licença estiver suspensa ou inativa
-    - Busca alunos respeitando RLS (somente do tenant do usuário)
+    - Busca alunos com o token do usuário (RLS aplicado por auth.uid())
     """
     # 1. Validação de Autenticação
     if 'user_id' not in session:
@@ -102,10 +109,10 @@ def gerenciar_alunos():
     # 3. Verificação de Licença (SOLUÇÃO DO ERRO PGRST116)
     tenant_status = verificar_licenca_tenant(tenant_id)
 
-    # 4. Busca de Alunos (Cliente Normal - Respeita RLS)
+    # 4. Busca de Alunos (Token do Usuário - Respeita RLS)
     students = []
     try:
-        resp_students = supabase.table('students')\
+        resp_students = get_user_db().table('students')\
             .select('*')\
             .eq('tenant_id', tenant_id)\
             .execute()
@@ -180,7 +187,7 @@ def suspender_aluno(student_id):
 
     try:
         # TODO: Descomentar quando implementar UPDATE
-        # supabase.table('students').update({'status': 'suspenso'}).eq('id', student_id).execute()
+        # get_user_db().table('students').update({'status': 'suspenso'}).eq('id', student_id).execute()
         flash(f"Aluno suspenso com sucesso.", "success")
     except Exception as e:
         print(f"❌ Erro ao suspender aluno: {e}")
@@ -1,5 +1,7 @@
 from flask import Blueprint, request, jsonify, session
 from supabase import create_client, Client
+from app.core.gateway import executar_consulta
+from app.core.tokens import get_user_db, criar_user_db
 import os
 import json
 
@@ -60,7 +62,8 @@ def create_activity():
     try:
         # 4. Execução da Transação Atômica
         # Chama a função 'create_full_activity_transaction' no Supabase
-        response = supabase.rpc('create_full_activity_transaction', rpc_params).execute()
+        # Executada com o token do usuário: RLS aplicado por auth.uid()
+        response = get_user_db().rpc('create_full_activity_transaction', rpc_params).execute()
         
         # O retorno data contém o ID da atividade criada (definido no SQL)
         new_activity_id = response.data
@@ -76,6 +79,22 @@ def create_activity():
         return jsonify({"error": f"Failed to save data: {str(e)}"}), 500
 
 
+def _listar_atividades(access_token, tenant_id):
+    """
+    Executada na thread do gateway: usa um cliente próprio (token capturado por valor),
+    pois o cliente da requisição (get_user_db) é fechado no teardown.
+    """
+    user_db = criar_user_db(access_token)
+    try:
+        return user_db.table('activities')\
+            .select('*, activity_schedules(*), pricing_plans(*)')\
+            .eq('tenant_id', tenant_id)\
+            .order('name')\
+            .execute()
+    finally:
+        user_db.session.close()
+
+
 @activities_bp.route('/activities', methods=['GET'])
 def get_activities():
     """
@@ -92,11 +111,14 @@ def get_activities():
     try:
         # Consulta hierárquica (Query Builder)
         # Traz activity_schedules e pricing_plans aninhados no JSON
-        response = supabase.table('activities')\
-            .select('*, activity_schedules(*), pricing_plans(*)')\
-            .eq('tenant_id', tenant_id)\
-            .order('name')\
-            .execute()
+        # Via camada compartilhada (singleflight + deadline + circuit breaker),
+        # com o token do usuário (RLS). Só agrupa requisições do mesmo usuário.
+        access_token = session.get('access_token')
+        response = executar_consulta(
+            ('activities', tenant_id, session.get('user_id')),
+            lambda: _listar_atividades(access_token, tenant_id),
+            servico='user'
+        )
 
         return jsonify(response.data), 200
 
@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask, session
+from jinja2 import Environment
+
+from app.core import auth
+from app.core.fragment_cache import FragmentCacheExtension
+
+TENANTS = {"t1": {"name": "UNIDADE 1", "role": "owner"}}
+
+
+def _modulo(module_id, is_enabled=True, tenant_id="t1"):
+    return {"tenant_id": tenant_id, "module_id": module_id, "is_enabled": is_enabled,
+            "modules": {"name": module_id.title()}}
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(auth, "admin_supabase", object())
+    app = Flask(__name__)
+    app.secret_key = "teste"
+    return app
+
+
+def _sincronizar(app, monkeypatch, modulos, dados_sessao):
+    monkeypatch.setattr(auth, "executar_consulta", lambda *a, **k: SimpleNamespace(data=modulos))
+    with app.test_request_context("/"):
+        session.update(dados_sessao)
+        auth.sincronizar_contextos()
+        return dict(session)
+
+
+def _sessao_logada(modulos):
+    return {
+        "user_id": "u1",
+        "role": "cliente",
+        "tenants": TENANTS,
+        "user_contexts": auth._montar_contextos(TENANTS, modulos),
+        "modules_version": auth._versao_modulos(modulos),
+        "modules_checked_at": 0,
+        "ctx_version": 1,
+        "tenant_id": "t1",
+        "module_id": "academia",
+    }
+
+
+def test_modulo_suspenso_sai_do_sidebar_e_do_contexto(app, monkeypatch):
+    sessao = _sessao_logada([_modulo("academia")])
+
+    nova = _sincronizar(app, monkeypatch, [_modulo("academia", is_enabled=False)], sessao)
+
+    assert nova["user_contexts"] == []
+    assert nova["tenant_id"] is None and nova["module_id"] is None
+    assert nova["ctx_version"] != 1
+
+
+def test_sem_mudanca_mantem_ctx_version(app, monkeypatch):
+    modulos = [_modulo("academia")]
+
+    nova = _sincronizar(app, monkeypatch, modulos, _sessao_logada(modulos))
+
+    assert nova["ctx_version"] == 1
+    assert nova["tenant_id"] == "t1"
+
+
+def test_fragmento_muda_com_a_chave():
+    env = Environment(extensions=[FragmentCacheExtension], autoescape=True)
+    template = env.from_string("{% cache 'sb', u, t, v %}{{ render() }}{% endcache %}")
+    chamadas = []
+
+    def render():
+        chamadas.append(1)
+        return "<b>sidebar</b>"
+
+    primeira = template.render(u="teste-u", t="t1", v=1, render=render)
+    template.render(u="teste-u", t="t1", v=1, render=render)
+    template.render(u="teste-u", t="t1", v=2, render=render)
+
+    assert len(chamadas) == 2
+    assert "&lt;b&gt;" in primeira
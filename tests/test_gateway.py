@@ -0,0 +1,61 @@
+import httpx
+import pytest
+from postgrest.exceptions import APIError
+
+from app.core import gateway
+from app.core.gateway import executar_consulta, CircuitoAbertoError
+
+
+def _api_error(code, message="erro"):
+    return APIError({"code": code, "message": message, "details": None, "hint": None})
+
+
+def _falhar(erro):
+    def consulta():
+        raise erro
+    return consulta
+
+
+@pytest.fixture(autouse=True)
+def estado_limpo():
+    gateway._breakers.clear()
+    gateway._ultimas_respostas.clear()
+    yield
+
+
+def test_rls_42501_nao_abre_circuito():
+    for i in range(gateway.LIMITE_FALHAS + 1):
+        with pytest.raises(APIError):
+            executar_consulta(('rls', i), _falhar(_api_error('42501')), servico='user')
+
+    assert gateway.get_breaker('user').estado == 'closed'
+
+
+def test_pgrst001_abre_circuito():
+    for i in range(gateway.LIMITE_FALHAS):
+        with pytest.raises(APIError):
+            executar_consulta(('pool', i), _falhar(_api_error('PGRST001')), servico='anon')
+
+    assert gateway.get_breaker('anon').estado == 'open'
+    with pytest.raises(CircuitoAbertoError):
+        executar_consulta(('pool', 'nova'), lambda: 'ok', servico='anon')
+
+
+def test_resposta_nao_json_5xx_conta_como_falha():
+    erro = _api_error(503, message="JSON could not be generated")
+    assert gateway._falha_de_infraestrutura(erro)
+    assert not gateway._falha_de_infraestrutura(_api_error(404, message="JSON could not be generated"))
+
+
+def test_falha_de_rede_serve_resposta_em_cache():
+    assert executar_consulta(('modules',), lambda: 'catalogo', servico='admin') == 'catalogo'
+    resposta = executar_consulta(('modules',), _falhar(httpx.ConnectError("fora do ar")), servico='admin')
+    assert resposta == 'catalogo'
+
+
+def test_breakers_independentes_por_cliente():
+    for i in range(gateway.LIMITE_FALHAS):
+        with pytest.raises(httpx.ConnectError):
+            executar_consulta(('x', i), _falhar(httpx.ConnectError("fora do ar")), servico='anon')
+
+    assert executar_consulta(('licenca', 't1'), lambda: 'active', servico='admin') == 'active'
@@ -0,0 +1,77 @@
+import time
+
+import jwt
+import pytest
+from flask import Flask, session, g
+
+from app.core import tokens
+
+SEGREDO = "segredo-de-teste-com-32-caracteres!!"
+
+
+def _token(expira_em, user_id="u1"):
+    return jwt.encode(
+        {"sub": user_id, "aud": "authenticated", "role": "authenticated", "exp": int(time.time() + expira_em)},
+        SEGREDO,
+        algorithm="HS256"
+    )
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(tokens, "supabase_url", "http://supabase.invalid")
+    monkeypatch.setattr(tokens, "jwt_secret", SEGREDO)
+    monkeypatch.setattr(tokens, "_algoritmos_ativos", {"HS256"})
+    tokens._renovacoes.clear()
+    app = Flask(__name__)
+    app.secret_key = "teste"
+    return app
+
+
+def _carregar(app, dados_sessao):
+    with app.test_request_context("/"):
+        session.update(dados_sessao)
+        tokens.carregar_usuario()
+        return g.user, dict(session)
+
+
+def test_role_e_o_papel_da_aplicacao(app):
+    usuario, _ = _carregar(app, {"user_id": "u1", "role": "cliente", "access_token": _token(600)})
+
+    assert usuario["role"] == "cliente"
+    assert usuario["jwt_role"] == "authenticated"
+
+
+def test_assinatura_invalida_encerra_sessao(app):
+    falso = jwt.encode({"sub": "u1", "aud": "authenticated", "exp": int(time.time() + 600)},
+                       "outra-chave-com-32-caracteres-aqui!!", algorithm="HS256")
+    usuario, dados = _carregar(app, {"user_id": "u1", "access_token": falso})
+
+    assert usuario is None
+    assert dados == {}
+
+
+def test_algoritmo_sem_chave_mantem_sessao(app):
+    rs = jwt.encode({"sub": "u1"}, "x" * 48, algorithm="HS384")
+    usuario, dados = _carregar(app, {"user_id": "u1", "access_token": rs})
+
+    assert usuario is None
+    assert dados["user_id"] == "u1"
+
+
+def test_renovacao_perto_de_expirar_vai_para_o_cookie_e_nao_rotaciona_duas_vezes(app, monkeypatch):
+    chamadas = []
+
+    def renovar(refresh_token):
+        chamadas.append(refresh_token)
+        return {"access_token": _token(3600), "refresh_token": "r2"}
+
+    monkeypatch.setattr(tokens, "_renovar_sessao", renovar)
+    sessao_antiga = {"user_id": "u1", "access_token": _token(30), "refresh_token": "r1"}
+
+    _, primeira = _carregar(app, sessao_antiga)
+    _, segunda = _carregar(app, sessao_antiga)
+
+    assert primeira["refresh_token"] == "r2"
+    assert segunda["refresh_token"] == "r2"
+    assert chamadas == ["r1"]